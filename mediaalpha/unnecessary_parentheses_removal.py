@@ -1,28 +1,41 @@
-import re
-from collections import namedtuple
-from enum import Enum, auto
+import sys
+from functools import lru_cache
 
 
-class State(Enum):
-    UNKNOWN = auto()
-    OPERAND = auto()
-    OPERATOR = auto()
+# tokenizer states: whether the last token seen was an operand or an operator
+S_UNKNOWN, S_OPERAND, S_OPERATOR = 0, 1, 2
 
+# the operator tokens; CPython already shares single-character strings, so interning them
+# only makes that explicit and does not speed up the table lookups below
+PLUS, MINUS, MUL, DIV, POW = map(sys.intern, "+-*/^")
 
-class Associativity(Enum):
-    LEFT = auto()
-    RIGHT = auto()
+# operator precedence, and the set of left associative operators ("^" is right associative)
+PREC = {PLUS: 0, MINUS: 0, MUL: 1, DIV: 1, POW: 2}
+LEFT = frozenset({PLUS, MINUS, MUL, DIV})
+OPERATORS = frozenset(PREC)
 
-
-opinfo = namedtuple("Operator", "precedence associativity")
-operator_info = {
-    "+": opinfo(0, Associativity.LEFT),
-    "-": opinfo(0, Associativity.LEFT),
-    "*": opinfo(1, Associativity.LEFT),
-    "/": opinfo(1, Associativity.LEFT),
-    "^": opinfo(2, Associativity.RIGHT),
+# SHOULD_POP[(top, current)] tells whether the operator at the top of the stack should be
+# moved to the output before pushing the current operator in the shunting yard
+SHOULD_POP = {
+    (top, current): PREC[top] > PREC[current]
+    or (PREC[top] == PREC[current] and top in LEFT)
+    for top in OPERATORS
+    for current in OPERATORS
 }
 
+# character classes for the tokenizer, looked up by ord(char) for ASCII input; anything not
+# listed (letters, digits, ...) is part of an operand
+C_OTHER, C_OP, C_LPAREN, C_RPAREN, C_SPACE = 0, 1, 2, 3, 4
+CLASS = bytearray(128)
+for _code in range(128):
+    if chr(_code).isspace():
+        CLASS[_code] = C_SPACE
+for _op in OPERATORS:
+    CLASS[ord(_op)] = C_OP
+CLASS[ord("(")] = C_LPAREN
+CLASS[ord(")")] = C_RPAREN
+del _code, _op
+
 
 def tokenize(input_string):
     """
@@ -36,31 +49,38 @@ def tokenize(input_string):
       a list of strings, representing operands and operators in the original order
 
     """
-    cleaned = re.sub(r"\s+", "", input_string)
-    chars = list(cleaned)
     output = []
-    state = State.UNKNOWN
+    state = S_UNKNOWN
     buf = ""
-    while len(chars) != 0:
-        char = chars.pop(0)
-        if char in ["(", ")"]:
-            output.append(buf) if buf != "" else False
-            buf = ""
-            output.append(char)
-        elif char in operator_info:
-            if char == "-" and (state == State.OPERATOR or state == State.UNKNOWN):
-                state = State.OPERAND
-            else:
-                state = State.OPERATOR
-            output.append(buf) if buf != "" else False
-            buf = char
+    for char in input_string:
+        code = ord(char)
+        if code < 128:
+            kind = CLASS[code]
         else:
-            if state != State.OPERAND:
-                output.append(buf) if buf != "" else False
+            kind = C_SPACE if char.isspace() else C_OTHER
+        if kind == C_OTHER:
+            if state != S_OPERAND:
+                if buf:
+                    output.append(buf)
                 buf = ""
-            state = State.OPERAND
+            state = S_OPERAND
             buf += char
-    output.append(buf) if buf != "" else False
+        elif kind == C_OP:
+            if char == MINUS and (state == S_OPERATOR or state == S_UNKNOWN):
+                state = S_OPERAND
+            else:
+                state = S_OPERATOR
+            if buf:
+                output.append(buf)
+            buf = char
+        elif kind != C_SPACE:
+            # parentheses
+            if buf:
+                output.append(buf)
+            buf = ""
+            output.append(char)
+    if buf:
+        output.append(buf)
     return output
 
 
@@ -76,52 +96,32 @@ def shunt(tokens):
       the list of operands and operators in postfix notation order
 
     """
-    tokens += ["end"]
     operators = []
     output = []
-    while len(tokens) != 1:
-        current_token = tokens.pop(0)
-        if current_token in operator_info.keys():
-            while True:
-                if len(operators) == 0:
-                    break
-                satisfied = False
-                if operators[-1] != "(":
-                    if (
-                        operator_info[operators[-1]].precedence
-                        > operator_info[current_token].precedence
-                    ):
-                        # operator at top has greater precedence
-                        satisfied = True
-                    elif (
-                        operator_info[operators[-1]].precedence
-                        == operator_info[current_token].precedence
-                    ):
-                        if (
-                            operator_info[operators[-1]].associativity
-                            == Associativity.LEFT
-                        ):
-                            satisfied = True
-                if not satisfied:
+    for current_token in tokens:
+        if current_token in OPERATORS:
+            while operators:
+                top = operators[-1]
+                if top == "(" or not SHOULD_POP[(top, current_token)]:
                     break
-                output.append(operators.pop())
+                operators.pop()
+                output.append(top)
             operators.append(current_token)
         elif current_token == "(":
             operators.append(current_token)
         elif current_token == ")":
-            while True:
-                if len(operators) == 0:
-                    break
-                if operators[-1] == "(":
-                    break
-                output.append(operators.pop())
-            if len(operators) != 0 and operators[-1] == "(":
-                operators.pop()
+            # move everything above the matching "(" to the output in one go, and drop the "(";
+            # an unmatched ")" flushes the whole stack
+            idx = len(operators) - 1
+            while idx >= 0 and operators[idx] != "(":
+                idx -= 1
+            output.extend(reversed(operators[idx + 1:]))
+            del operators[max(idx, 0):]
         else:
             # is an operand
             output.append(current_token)
 
-    output.extend(operators[::-1])
+    output.extend(reversed(operators))
     return output
 
 
@@ -133,6 +133,8 @@ def restore(postfix_list):
       postfix_list: the list of operands/operators in the reverse Polish order
     Returns:
       a string representation of the arithmetic expression without the unnecessary parenthese.
+    Raises:
+      ValueError: if the expression is empty or an operator does not have two operands
 
 
     The basic idea of the algorithm is:
@@ -153,54 +155,64 @@ def restore(postfix_list):
         with and without parentheses for the right expression.
 
     """
-    # reconstruct the postfix_list so that we could keep track of the current pivotal operator
-    # of the operand/expression. For basic operands, the pivotal operator is given a dummy value ""
-    postfix_obj_list = [(v, "") for v in postfix_list]
-    idx = 0
-    while idx < len(postfix_obj_list):
-        if postfix_obj_list[idx][0] in operator_info:
-            if idx >= 2:
-                new_expr = None
-                if (
-                    postfix_obj_list[idx - 2][1] != ""
-                    and operator_info[postfix_obj_list[idx][0]].precedence
-                    > operator_info[postfix_obj_list[idx - 2][1]].precedence
-                ):
-                    new_expr = "(" + postfix_obj_list[idx - 2][0] + ")"
-                else:
-                    new_expr = postfix_obj_list[idx - 2][0]
-
-                new_expr += postfix_obj_list[idx][0]
-
-                if postfix_obj_list[idx - 1][1] != "":
-                    if operator_info[
-                        postfix_obj_list[idx][0]
-                    ].precedence > operator_info[
-                        postfix_obj_list[idx - 1][1]
-                    ].precedence or (
-                        operator_info[postfix_obj_list[idx][0]].precedence
-                        == operator_info[postfix_obj_list[idx - 1][1]].precedence
-                        and (postfix_obj_list[idx][0] == "/" or postfix_obj_list[idx][0] == "-")
-                    ):
-                        new_expr += "(" + postfix_obj_list[idx - 1][0] + ")"
-                    else:
-                        new_expr += postfix_obj_list[idx - 1][0]
-
-                else:
-                    new_expr += postfix_obj_list[idx - 1][0]
-
-                postfix_obj_list = (
-                    postfix_obj_list[: idx - 2]
-                    + [(new_expr, postfix_obj_list[idx][0])]
-                    + postfix_obj_list[idx + 1:]
-                )
-                idx = idx - 2
-        else:
-            idx += 1
-
-    return postfix_obj_list[0][0]
-
-
+    # keep track of the current pivotal operator of each operand/expression on the stack, in a
+    # parallel list. For basic operands, the pivotal operator is given a dummy value ""
+    expr_stack = []
+    pivot_stack = []
+    for token in postfix_list:
+        if token not in OPERATORS:
+            expr_stack.append(token)
+            pivot_stack.append("")
+            continue
+
+        if len(expr_stack) < 2:
+            raise ValueError("operator " + token + " is missing an operand")
+        right_expr = expr_stack.pop()
+        right_pivot = pivot_stack.pop()
+        left_expr = expr_stack.pop()
+        left_pivot = pivot_stack.pop()
+
+        left_open, left_close = _wrap(left_pivot, token, False)
+        right_open, right_close = _wrap(right_pivot, token, True)
+        expr_stack.append(
+            "".join(
+                (left_open, left_expr, left_close, token, right_open, right_expr, right_close)
+            )
+        )
+        pivot_stack.append(token)
+
+    if not expr_stack:
+        raise ValueError("empty expression")
+    # the bottom of the stack holds the restored expression; anything above it is left over
+    # from malformed input, e.g. the "(" of an unclosed parenthesis
+    return expr_stack[0]
+
+
+WRAP = ("(", ")")
+NO_WRAP = ("", "")
+
+
+def _wrap(pivot, op, is_right):
+    """
+    Return the (prefix, suffix) to put around an operand of op whose pivotal operator is pivot,
+    see restore for the rules. The caller joins them with the operand, so the operand string is
+    copied only once.
+    """
+    if not pivot:
+        return NO_WRAP
+    op_prec = PREC[op]
+    pivot_prec = PREC[pivot]
+    if op_prec > pivot_prec:
+        return WRAP
+    if is_right and op_prec == pivot_prec and (op == DIV or op == MINUS):
+        return WRAP
+    return NO_WRAP
+
+
+# the result only depends on the input string, so repeated expressions (common when exploring
+# in the interactive loop) are answered from the cache; use
+# remove_unnecessary_parentheses.__wrapped__ to bypass it, e.g. when timing the parser
+@lru_cache(maxsize=1024)
 def remove_unnecessary_parentheses(input_expr):
     return restore(shunt(tokenize(input_expr)))
 
@@ -223,6 +235,20 @@ def run_test():
         remove_unnecessary_parentheses("(x1+y1)*(x2*y2-(x3*y3))")
         == "(x1+y1)*(x2*y2-x3*y3)"
     )
+    # non-ASCII whitespace is skipped like ASCII whitespace
+    assert remove_unnecessary_parentheses("1\u00a0+\u30002") == "1+2"
+    # an unmatched ")" closes everything before it
+    assert remove_unnecessary_parentheses("1+2)*3") == "(1+2)*3"
+    # unclosed parentheses are ignored, operators without two operands are rejected
+    assert remove_unnecessary_parentheses("(1+2") == "1+2"
+    assert remove_unnecessary_parentheses("((a-b)") == "a-b"
+    for malformed in ["-", "/", "1+", ""]:
+        try:
+            remove_unnecessary_parentheses(malformed)
+        except ValueError:
+            pass
+        else:
+            assert False, malformed
 
 
 if __name__ == "__main__":
@@ -234,4 +260,7 @@ if __name__ == "__main__":
             run_test()
             print("All test pass")
         else:
-            print("Output: " + remove_unnecessary_parentheses(user_input))
+            try:
+                print("Output: " + remove_unnecessary_parentheses(user_input))
+            except ValueError as e:
+                print("Invalid expression: " + str(e))